@@ -13,16 +13,43 @@
 # See LICENSE.md and COMMERCIAL.md
 
 import math
+import json
 import asyncio
-from dataclasses import dataclass
+import functools
+import numpy as np
+from dataclasses import dataclass, field
 from aiohttp import web
 import logging
 import re
 import time
-from collections import defaultdict
-from typing import Optional, Dict
+from collections import OrderedDict
+from typing import Optional, Mapping
 from datetime import datetime, timedelta
 
+try:
+    from numba import njit
+except ImportError:  # numba is optional; fall back to plain Python
+    def njit(*args, **kwargs):
+        if args and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:  # orjson is optional; fall back to the stdlib codec
+    def json_dumps(obj): return json.dumps(obj).encode()
+    json_loads = json.loads
+
+try:
+    import uvloop
+except ImportError:  # uvloop is optional; use the default asyncio loop
+    uvloop = None
+
+try:
+    import hyperscan
+except ImportError:  # hyperscan is optional; fall back to the re alternation
+    hyperscan = None
+
 # Setup logging for security events
 logging.basicConfig(level=logging.INFO)
 security_logger = logging.getLogger("WAF")
@@ -31,37 +58,82 @@ security_logger = logging.getLogger("WAF")
 # WAF - Rate Limiting & Tracking
 # =============================
 
+@dataclass(slots=True)
+class ClientWindow:
+    """Per-IP rate limit state: the previous and current window counters"""
+    prev_count: int = 0
+    curr_count: int = 0
+    curr_start: float = 0.0
+    blocked_until: float = 0.0
+
 class RateLimiter:
-    """Rate limiter with IP-based tracking"""
-    def __init__(self, requests_per_minute=300, window_seconds=60):
+    """Rate limiter with IP-based tracking (sliding-window counter)"""
+    def __init__(self, requests_per_minute=300, window_seconds=60,
+                 block_seconds=300, max_tracked_ips=100_000):
         self.requests_per_minute = requests_per_minute
         self.window_seconds = window_seconds
-        self.requests: Dict[str, list] = defaultdict(list)
-        self.blocked_ips: Dict[str, float] = {}
-
-    def is_blocked(self, ip: str) -> bool:
-        """Check if IP is currently blocked"""
-        if ip in self.blocked_ips:
-            if time.time() - self.blocked_ips[ip] < 300:  # 5 min block
-                return True
-            del self.blocked_ips[ip]
-        return False
-
-    def check_rate_limit(self, ip: str) -> bool:
-        """Check if request exceeds rate limit"""
-        now = time.time()
+        self.block_seconds = block_seconds
+        self.max_tracked_ips = max_tracked_ips
+        # Kept in least-recently-seen order so the oldest IP is evicted first
+        self.clients: OrderedDict[str, ClientWindow] = OrderedDict()
+
+    def check(self, ip: str, now: Optional[float] = None) -> tuple[bool, Optional[str]]:
+        """Count a request from ip; return (allowed, reason if rejected)"""
+        now = time.time() if now is None else now
+        
+        entry = self.clients.get(ip)
+        if entry is None:
+            entry = self.clients[ip] = ClientWindow(curr_start=now)
+            if len(self.clients) > self.max_tracked_ips:
+                self._evict(now)
+        elif entry.blocked_until > now:
+            return False, "IP is blocked"
+        else:
+            self.clients.move_to_end(ip)
         
-        # Clean old requests outside window
-        self.requests[ip] = [t for t in self.requests[ip] 
-                             if now - t < self.window_seconds]
+        # Rotate buckets once the current window has elapsed
+        window = self.window_seconds
+        elapsed = now - entry.curr_start
+        if elapsed >= window:
+            entry.prev_count = entry.curr_count if elapsed < 2 * window else 0
+            entry.curr_count = 0
+            entry.curr_start += window * (elapsed // window)
+            elapsed = now - entry.curr_start
         
-        if len(self.requests[ip]) >= self.requests_per_minute:
+        # Weight the previous window by how much of it still overlaps
+        estimated = entry.prev_count * (1 - elapsed / window) + entry.curr_count
+        if estimated >= self.requests_per_minute:
             security_logger.warning(f"Rate limit exceeded for IP: {ip}")
-            self.blocked_ips[ip] = now
-            return False
+            entry.blocked_until = now + self.block_seconds
+            return False, "Rate limit exceeded"
         
-        self.requests[ip].append(now)
-        return True
+        entry.curr_count += 1
+        return True, None
+
+    def _evict(self, now: float) -> None:
+        """Drop the least recently seen IP that is not banned"""
+        # Banned IPs are moved to the recent end rather than dropped, so
+        # eviction cannot lift a ban; the new IP (last) is never a candidate.
+        # If every older IP is banned the table overflows by banned IPs only.
+        for _ in range(len(self.clients) - 1):
+            ip, entry = self.clients.popitem(last=False)
+            if entry.blocked_until <= now:
+                return
+            self.clients[ip] = entry
+
+    def sweep(self, now: Optional[float] = None) -> None:
+        """Drop state for IPs that have gone quiet and are no longer banned"""
+        now = time.time() if now is None else now
+        stale_after = 2 * self.window_seconds  # both buckets would read zero
+        for ip, entry in list(self.clients.items()):
+            if entry.blocked_until <= now and now - entry.curr_start >= stale_after:
+                del self.clients[ip]
+
+    async def run_sweeper(self, interval: float = 30.0) -> None:
+        """Periodically sweep so per-IP state stays bounded"""
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
 
 rate_limiter = RateLimiter(requests_per_minute=300)
 
@@ -69,72 +141,107 @@ rate_limiter = RateLimiter(requests_per_minute=300)
 # WAF - Input Validation
 # =============================
 
+def _build_hyperscan_db(patterns: list) -> Optional["hyperscan.Database"]:
+    """Compile attack patterns into one Hyperscan block-mode database"""
+    if hyperscan is None:
+        return None
+    db = hyperscan.Database()
+    db.compile(
+        expressions=patterns,
+        ids=list(range(len(patterns))),
+        elements=len(patterns),
+        flags=hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH,
+    )
+    return db
+
+def _on_hyperscan_match(pattern_id, start, end, flags, hits):
+    hits.append(pattern_id)
+    return True  # stop at the first match
+
 class InputValidator:
     """Comprehensive input validation"""
     
-    # Regex patterns for attack detection
+    # Regex patterns for attack detection, applied to the raw request body.
+    # '"' is left out of the SQL set because it delimits every JSON string.
     SQL_INJECTION_PATTERN = re.compile(
-        r"(\b(UNION|SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|EXECUTE|SCRIPT|JAVASCRIPT|EVAL)\b)|"
-        r"(--|;|\'|\"|\*|\/\*|\*\/|xp_|sp_)",
+        rb"(\b(UNION|SELECT|INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|EXEC|EXECUTE|SCRIPT|JAVASCRIPT|EVAL)\b)|"
+        rb"(--|;|\'|\*|\/\*|\*\/|xp_|sp_)",
         re.IGNORECASE
     )
     
     XSS_PATTERN = re.compile(
-        r"(<script|javascript:|onerror=|onload=|onclick=|eval\(|expression\(|<iframe|<object|<embed)",
+        rb"(<script|javascript:|onerror=|onload=|onclick=|eval\(|expression\(|<iframe|<object|<embed)",
         re.IGNORECASE
     )
     
-    PATH_TRAVERSAL_PATTERN = re.compile(r"(\.\./|\.\.\\|%2e%2e)")
+    PATH_TRAVERSAL_PATTERN = re.compile(rb"(\.\./|\.\.\\|%2e%2e)", re.IGNORECASE)
     
     COMMAND_INJECTION_PATTERN = re.compile(
-        r"(;\s*cat|;\s*rm|;\s*ls|`|sh\s+-c|bash\s+-c|\$\(|\|\||&&|\||&)",
+        rb"(;\s*cat|;\s*rm|;\s*ls|`|sh\s+-c|bash\s+-c|\$\(|\|\||&&|\||&)",
         re.IGNORECASE
     )
 
+    # JSON escapes (e.g. \u0027) would hide characters from a raw-byte scan
+    ESCAPE_PATTERN = re.compile(rb"(\\)")
+
+    # All of the above as one alternation, so the body is scanned once (re fallback)
+    _COMBINED = re.compile(
+        b"(?P<sql>" + SQL_INJECTION_PATTERN.pattern + b")|"
+        b"(?P<xss>" + XSS_PATTERN.pattern + b")|"
+        b"(?P<path>" + PATH_TRAVERSAL_PATTERN.pattern + b")|"
+        b"(?P<cmd>" + COMMAND_INJECTION_PATTERN.pattern + b")|"
+        b"(?P<esc>" + ESCAPE_PATTERN.pattern + b")",
+        re.IGNORECASE
+    )
+    _ATTACK_NAMES = {
+        "sql": "SQL injection",
+        "xss": "XSS",
+        "path": "Path traversal",
+        "cmd": "Command injection",
+        "esc": "Escaped payload",
+    }
+
+    # Same patterns as a Hyperscan DFA when available (ids index _ATTACK_KEYS)
+    _ATTACK_KEYS = ("sql", "xss", "path", "cmd", "esc")
+    _HS_DB = _build_hyperscan_db([
+        SQL_INJECTION_PATTERN.pattern,
+        XSS_PATTERN.pattern,
+        PATH_TRAVERSAL_PATTERN.pattern,
+        COMMAND_INJECTION_PATTERN.pattern,
+        ESCAPE_PATTERN.pattern,
+    ])
+
     @staticmethod
-    def validate_json_input(data: dict, max_size: int = 1024) -> tuple[bool, Optional[str]]:
-        """Validate JSON input for attacks"""
-        if not isinstance(data, dict):
-            return False, "Invalid JSON structure"
-        
+    def _scan(body: bytes) -> Optional[str]:
+        """Return the key of the first attack pattern found in body, if any"""
+        if InputValidator._HS_DB is not None:
+            hits = []
+            try:
+                InputValidator._HS_DB.scan(body, match_event_handler=_on_hyperscan_match, context=hits)
+            except hyperscan.ScanTerminated:
+                pass
+            return InputValidator._ATTACK_KEYS[hits[0]] if hits else None
+
+        match = InputValidator._COMBINED.search(body)
+        return match.lastgroup if match else None
+
+    @staticmethod
+    def validate_json_input(body: bytes, max_size: int = 1024) -> tuple[bool, Optional[str]]:
+        """Validate a raw JSON request body for attacks"""
         # Check size
-        import sys
-        if sys.getsizeof(str(data)) > max_size:
-            security_logger.warning(f"Payload exceeds max size: {sys.getsizeof(str(data))} bytes")
+        if len(body) > max_size:
+            security_logger.warning(f"Payload exceeds max size: {len(body)} bytes")
             return False, "Payload too large"
         
-        # Check for suspicious patterns
-        data_str = str(data).lower()
-        
-        if InputValidator.SQL_INJECTION_PATTERN.search(data_str):
-            security_logger.warning(f"SQL injection attempt detected: {data}")
-            return False, "Invalid characters detected"
-        
-        if InputValidator.XSS_PATTERN.search(data_str):
-            security_logger.warning(f"XSS attempt detected: {data}")
-            return False, "Invalid characters detected"
-        
-        if InputValidator.PATH_TRAVERSAL_PATTERN.search(data_str):
-            security_logger.warning(f"Path traversal attempt detected: {data}")
-            return False, "Invalid characters detected"
-        
-        if InputValidator.COMMAND_INJECTION_PATTERN.search(data_str):
-            security_logger.warning(f"Command injection attempt detected: {data}")
+        # Check for suspicious patterns in a single pass
+        attack_key = InputValidator._scan(body)
+        if attack_key:
+            attack = InputValidator._ATTACK_NAMES[attack_key]
+            security_logger.warning(f"{attack} attempt detected: {body!r}")
             return False, "Invalid characters detected"
         
         return True, None
 
-    @staticmethod
-    def validate_numeric_input(value: any, min_val: float, max_val: float) -> tuple[bool, Optional[str]]:
-        """Validate numeric input"""
-        try:
-            num = int(value) if isinstance(value, (int, str)) else float(value)
-            if not (min_val <= num <= max_val):
-                return False, f"Value must be between {min_val} and {max_val}"
-            return True, None
-        except (ValueError, TypeError):
-            return False, "Invalid numeric value"
-
 validator = InputValidator()
 
 # =============================
@@ -149,26 +256,29 @@ class RequestFilter:
         'sqlmap', 'nikto', 'nmap', 'nessus', 'masscan',
         'burp', 'zaproxy', 'metasploit', 'curl', 'wget'
     ]
+    _USER_AGENT_PATTERN = re.compile(
+        "|".join(map(re.escape, SUSPICIOUS_USER_AGENTS)), re.IGNORECASE
+    )
     
     # Forbidden headers
     FORBIDDEN_HEADERS = {'x-forwarded-for', 'x-real-ip', 'x-originating-ip'}
 
+    MAX_CONTENT_LENGTH = 10 * 1024  # 10 KB
+
     @staticmethod
     def check_user_agent(user_agent: Optional[str]) -> bool:
         """Check for suspicious User-Agent"""
         if not user_agent:
             return True
         
-        ua_lower = user_agent.lower()
-        for suspicious_ua in RequestFilter.SUSPICIOUS_USER_AGENTS:
-            if suspicious_ua in ua_lower:
-                security_logger.warning(f"Suspicious User-Agent detected: {user_agent}")
-                return False
+        if RequestFilter._USER_AGENT_PATTERN.search(user_agent):
+            security_logger.warning(f"Suspicious User-Agent detected: {user_agent}")
+            return False
         return True
 
     @staticmethod
-    def check_headers(headers: dict) -> bool:
-        """Check for suspicious headers"""
+    def check_headers(headers: Mapping[str, str]) -> bool:
+        """Check for suspicious headers (case-insensitive with aiohttp headers)"""
         for forbidden in RequestFilter.FORBIDDEN_HEADERS:
             if forbidden in headers:
                 security_logger.warning(f"Forbidden header detected: {forbidden}")
@@ -178,12 +288,10 @@ class RequestFilter:
     @staticmethod
     def check_request_size(content_length: Optional[str]) -> bool:
         """Check request size"""
-        MAX_CONTENT_LENGTH = 10 * 1024  # 10 KB
-        
         if content_length:
             try:
                 size = int(content_length)
-                if size > MAX_CONTENT_LENGTH:
+                if size > RequestFilter.MAX_CONTENT_LENGTH:
                     security_logger.warning(f"Request too large: {size} bytes")
                     return False
             except ValueError:
@@ -196,65 +304,58 @@ request_filter = RequestFilter()
 # WAF - Middleware
 # ================================
 
+def json_response(payload, status=200):
+    """Like web.json_response, but encoded with json_dumps (orjson if available)"""
+    return web.Response(body=json_dumps(payload), status=status,
+                        content_type="application/json")
+
+@functools.lru_cache(maxsize=None)
+def _error_body(message: str) -> bytes:
+    return json_dumps({"error": message})
+
+def error_response(message: str, status: int):
+    """JSON error response; the body for each (fixed) message is encoded once"""
+    return web.Response(body=_error_body(message), status=status,
+                        content_type="application/json")
+
 @web.middleware
 async def waf_middleware(request: web.Request, handler):
     """WAF middleware for all requests"""
     
     client_ip = request.remote or "unknown"
     
-    # Check if IP is rate-limited
-    if rate_limiter.is_blocked(client_ip):
-        security_logger.error(f"Blocked request from rate-limited IP: {client_ip}")
-        return web.json_response(
-            {"error": "Too many requests"},
-            status=429
-        )
+    # Check block list and rate limit first so banned IPs cost one lookup
+    allowed, reason = rate_limiter.check(client_ip)
+    if not allowed:
+        security_logger.error(f"Blocked request from {client_ip}: {reason}")
+        return error_response("Too many requests", 429)
     
-    # Check rate limit
-    if not rate_limiter.check_rate_limit(client_ip):
-        security_logger.error(f"Rate limit exceeded for IP: {client_ip}")
-        return web.json_response(
-            {"error": "Too many requests"},
-            status=429
-        )
+    # Check request size
+    content_length = request.headers.get('Content-Length')
+    if not request_filter.check_request_size(content_length):
+        security_logger.error(f"Request too large from {client_ip}")
+        return error_response("Payload too large", 413)
     
     # Check User-Agent
     user_agent = request.headers.get('User-Agent', '')
     if not request_filter.check_user_agent(user_agent):
         security_logger.error(f"Blocked suspicious User-Agent from {client_ip}: {user_agent}")
-        return web.json_response(
-            {"error": "Forbidden"},
-            status=403
-        )
+        return error_response("Forbidden", 403)
     
     # Check headers
-    if not request_filter.check_headers(dict(request.headers)):
+    if not request_filter.check_headers(request.headers):
         security_logger.error(f"Blocked request with forbidden headers from {client_ip}")
-        return web.json_response(
-            {"error": "Forbidden"},
-            status=403
-        )
+        return error_response("Forbidden", 403)
     
-    # Check request size
-    content_length = request.headers.get('Content-Length')
-    if not request_filter.check_request_size(content_length):
-        security_logger.error(f"Request too large from {client_ip}")
-        return web.json_response(
-            {"error": "Payload too large"},
-            status=413
-        )
-    
-    # Log request
-    security_logger.info(f"Request from {client_ip}: {request.method} {request.path}")
+    # Log request (debug only; security events are logged at WARNING/ERROR)
+    if security_logger.isEnabledFor(logging.DEBUG):
+        security_logger.debug(f"Request from {client_ip}: {request.method} {request.path}")
     
     try:
         response = await handler(request)
     except Exception as e:
         security_logger.error(f"Error processing request from {client_ip}: {str(e)}")
-        return web.json_response(
-            {"error": "Internal server error"},
-            status=500
-        )
+        return error_response("Internal server error", 500)
     
     # Add security headers to response
     response.headers['X-Content-Type-Options'] = 'nosniff'
@@ -270,15 +371,20 @@ async def waf_middleware(request: web.Request, handler):
 # Utilities
 # -----------------------------
 
-def clamp(x, lo, hi): return max(lo, min(hi, x))
-def deg2rad(d): return d * math.pi / 180
-def rad2deg(r): return r * 180 / math.pi
+_DEG2RAD = math.pi / 180
+_RAD2DEG = 180 / math.pi
+# Fin deflection (deg) to attitude rate (rad/s)
+_FIN_RATE = _DEG2RAD * 0.1
+
+def clamp(x, lo, hi): return lo if x < lo else hi if x > hi else x
+def deg2rad(d): return d * _DEG2RAD
+def rad2deg(r): return r * _RAD2DEG
 
 # -----------------------------
 # Vehicle Parameters
 # -----------------------------
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class VehicleParams:
     mass: float = 500.0
     Ixx: float = 90.0
@@ -291,154 +397,375 @@ class VehicleParams:
     fin_area: float = 0.0207
     fin_lift_slope: float = 3.5
     fin_x: float = -1.8
+    # Derived constants, computed once in __post_init__
+    k_drag: float = field(init=False, repr=False)
+    inv_mass: float = field(init=False, repr=False)
+
+    def __post_init__(self):
+        object.__setattr__(self, "k_drag", 0.5 * self.rho * self.Cd * self.area_ref)
+        object.__setattr__(self, "inv_mass", 1.0 / self.mass)
 
 # -----------------------------
 # State
 # -----------------------------
 
-@dataclass
+@dataclass(slots=True)
 class SimState:
-    pos: list
-    vel: list
-    omega: list
+    pos: np.ndarray
+    vel: np.ndarray
+    omega: np.ndarray
     yaw: float
     pitch: float
     roll: float
 
+@dataclass(slots=True)
+class FleetState:
+    """N vehicles as struct-of-arrays: pos/vel are (N, 3), yaw/pitch are (N,)
+
+    Fleet arrays default to float32: batched stepping is memory-bound and the
+    model does not need double precision at fleet scale.
+    """
+    pos: np.ndarray
+    vel: np.ndarray
+    yaw: np.ndarray
+    pitch: np.ndarray
+
+    @classmethod
+    def zeros(cls, n, dtype=np.float32):
+        return cls(pos=np.zeros((n, 3), dtype), vel=np.zeros((n, 3), dtype),
+                   yaw=np.zeros(n, dtype), pitch=np.zeros(n, dtype))
+
+
+@dataclass(slots=True)
+class FleetAoSoA:
+    """N vehicles in 4-lane tiles: pos/vel are (T, 3, 4), yaw/pitch are (T, 4), T = ceil(N/4).
+
+    Vehicle i lives in tile i // 4, lane i % 4, so each axis of a tile is four
+    contiguous values (one AVX2 register as float64, half of one as the
+    default float32). Lanes past n are padding.
+    """
+    n: int
+    pos: np.ndarray
+    vel: np.ndarray
+    yaw: np.ndarray
+    pitch: np.ndarray
+
+    @classmethod
+    def zeros(cls, n, dtype=np.float32):
+        t = -(-n // 4)
+        return cls(n=n, pos=np.zeros((t, 3, 4), dtype), vel=np.zeros((t, 3, 4), dtype),
+                   yaw=np.zeros((t, 4), dtype), pitch=np.zeros((t, 4), dtype))
+
+    def tile(self, values):
+        """Lay out a length-N per-vehicle array as (T, 4), zero-padding the last tile"""
+        out = np.zeros(self.yaw.shape, self.yaw.dtype)
+        out.reshape(-1)[:self.n] = values
+        return out
+
+    def to_fleet(self):
+        """Copy back out to a struct-of-arrays FleetState"""
+        n = self.n
+        return FleetState(pos=self.pos.transpose(0, 2, 1).reshape(-1, 3)[:n].copy(),
+                          vel=self.vel.transpose(0, 2, 1).reshape(-1, 3)[:n].copy(),
+                          yaw=self.yaw.reshape(-1)[:n].copy(),
+                          pitch=self.pitch.reshape(-1)[:n].copy())
+
 # -----------------------------
 # Controls
 # -----------------------------
 
-@dataclass
 class Controls:
-    pitch_fin: int = 0
-    yaw_fin: int = 0
-    prop: int = 0
+    """Fin and propeller commands packed into one int, 8 bits per field.
+
+    pitch_fin occupies bits 16-23, yaw_fin bits 8-15 and prop bits 0-7, each
+    stored offset by 128. Assignments saturate to the actuator limits
+    (fins to [-30, 30], prop to [-30, 100]) and are then truncated to int, so
+    float and NumPy scalars are accepted; NaN raises ValueError. The whole
+    command vector is a single word that can be read or copied at once.
+    """
+    __slots__ = ("_raw",)
+
+    def __init__(self, pitch_fin=0, yaw_fin=0, prop=0):
+        self._raw = 0x808080
+        self.pitch_fin = pitch_fin
+        self.yaw_fin = yaw_fin
+        self.prop = prop
+
+    @property
+    def pitch_fin(self):
+        return ((self._raw >> 16) & 0xFF) - 128
+
+    @pitch_fin.setter
+    def pitch_fin(self, v):
+        v = int(-30 if v < -30 else 30 if v > 30 else v)
+        self._raw = (self._raw & 0x00FFFF) | ((v + 128) << 16)
+
+    @property
+    def yaw_fin(self):
+        return ((self._raw >> 8) & 0xFF) - 128
+
+    @yaw_fin.setter
+    def yaw_fin(self, v):
+        v = int(-30 if v < -30 else 30 if v > 30 else v)
+        self._raw = (self._raw & 0xFF00FF) | ((v + 128) << 8)
+
+    @property
+    def prop(self):
+        return (self._raw & 0xFF) - 128
+
+    @prop.setter
+    def prop(self, v):
+        v = int(-30 if v < -30 else 100 if v > 100 else v)
+        self._raw = (self._raw & 0xFFFF00) | (v + 128)
+
+    def unpack(self):
+        """Decode (pitch_fin, yaw_fin, prop) from a single read of the packed word"""
+        raw = self._raw
+        return ((raw >> 16) & 0xFF) - 128, ((raw >> 8) & 0xFF) - 128, (raw & 0xFF) - 128
+
+    def __eq__(self, other):
+        if type(other) is not Controls:
+            return NotImplemented
+        return self._raw == other._raw
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "Controls(pitch_fin=%d, yaw_fin=%d, prop=%d)" % self.unpack()
 
 # -----------------------------
 # Core Physics
 # -----------------------------
 
-def drag_force(params, vel):
-    v = math.sqrt(sum(v*v for v in vel))
-    if v < 1e-6:
-        return [0,0,0]
-    k = 0.5 * params.rho * params.Cd * params.area_ref
-    return [-k*v*vel[0], -k*v*vel[1], -k*v*vel[2]]
-
-def step_sim(params, state, ctrl, dt):
-    Fx = params.thrust_max * (ctrl.prop / 100.0)
-    Fd = drag_force(params, state.vel)
-
-    ax = (Fx + Fd[0]) / params.mass
-    ay = Fd[1] / params.mass
-    az = Fd[2] / params.mass
+@njit(cache=True, fastmath=True)
+def _drag_coeff(k_drag, vx, vy, vz):
+    """Quadratic drag as a per-axis coefficient k, so that F_drag = -k * vel."""
+    v = math.sqrt(vx*vx + vy*vy + vz*vz)
+    return k_drag * v if v >= 1e-6 else 0.0
 
-    state.vel[0] += ax * dt
-    state.vel[1] += ay * dt
-    state.vel[2] += az * dt
-
-    state.pos[0] += state.vel[0] * dt
-    state.pos[1] += state.vel[1] * dt
-    state.pos[2] += state.vel[2] * dt
+def drag_force(params, vel):
+    vx, vy, vz = vel
+    k = _drag_coeff(params.k_drag, vx, vy, vz)
+    return (-k*vx, -k*vy, -k*vz)
+
+@njit(cache=True, fastmath=True)
+def _step(pos, vel, yaw, pitch, thrust_max, inv_mass, k_drag,
+          prop, yaw_fin, pitch_fin, dt):
+    """Advance pos/vel in place; return the new (yaw, pitch)."""
+    vx = vel[0]
+    vy = vel[1]
+    vz = vel[2]
+    k = _drag_coeff(k_drag, vx, vy, vz)
+
+    Fx = thrust_max * (prop / 100.0)
+    a_dt = inv_mass * dt
+    vx += (Fx - k*vx) * a_dt
+    vy -= k*vy * a_dt
+    vz -= k*vz * a_dt
+
+    # Write back once; pos integrates the updated velocity (semi-implicit Euler)
+    vel[0] = vx
+    vel[1] = vy
+    vel[2] = vz
+    pos[0] += vx * dt
+    pos[1] += vy * dt
+    pos[2] += vz * dt
 
     # Simple yaw/pitch from fins
-    state.yaw   += deg2rad(ctrl.yaw_fin)   * dt * 0.1
-    state.pitch += deg2rad(ctrl.pitch_fin) * dt * 0.1
+    fin_gain = _FIN_RATE * dt
+    return yaw + yaw_fin * fin_gain, pitch + pitch_fin * fin_gain
+
+def step_sim(params, state, ctrl, dt):
+    pitch_fin, yaw_fin, prop = ctrl.unpack()
+    state.yaw, state.pitch = _step(
+        state.pos, state.vel, state.yaw, state.pitch,
+        params.thrust_max, params.inv_mass, params.k_drag,
+        prop, yaw_fin, pitch_fin, dt)
+
+@njit(cache=True, fastmath=True)
+def _run(pos, vel, yaw, pitch, thrust_max, inv_mass, k_drag,
+         prop, yaw_fin, pitch_fin, dt, n_steps):
+    for _ in range(n_steps):
+        yaw, pitch = _step(pos, vel, yaw, pitch, thrust_max, inv_mass, k_drag,
+                           prop, yaw_fin, pitch_fin, dt)
+    return yaw, pitch
+
+def run_sim(params, state, ctrl, dt, n_steps):
+    """Advance state by n_steps steps of dt with fixed controls, in one compiled loop"""
+    pitch_fin, yaw_fin, prop = ctrl.unpack()
+    state.yaw, state.pitch = _run(
+        state.pos, state.vel, state.yaw, state.pitch,
+        params.thrust_max, params.inv_mass, params.k_drag,
+        prop, yaw_fin, pitch_fin, dt, n_steps)
+
+def step_sim_batch(params, fleet, prop, yaw_fin, pitch_fin, dt):
+    """Advance every vehicle in fleet by dt in one vectorized pass.
+
+    prop/yaw_fin/pitch_fin are per-vehicle arrays of length N (or scalars
+    applied to the whole fleet); the model matches step_sim.
+    """
+    vel = fleet.vel
+    # Match the controls to the fleet dtype so float32 fleets stay float32
+    dtype = vel.dtype
+    prop = np.asarray(prop, dtype)
+    yaw_fin = np.asarray(yaw_fin, dtype)
+    pitch_fin = np.asarray(pitch_fin, dtype)
+    a_dt = params.inv_mass * dt
+    speed = np.sqrt(np.einsum("ij,ij->i", vel, vel))
+    vel -= (params.k_drag * a_dt * speed)[:, None] * vel
+    vel[:, 0] += (params.thrust_max / 100.0 * a_dt) * prop
+    fleet.pos += vel * dt
+
+    fin_gain = _FIN_RATE * dt
+    fleet.yaw += yaw_fin * fin_gain
+    fleet.pitch += pitch_fin * fin_gain
+
+@njit(cache=True, fastmath=True)
+def _step_tiles(pos, vel, yaw, pitch, f_dt, kd_dt, fin_gain,
+                prop, yaw_fin, pitch_fin, dt):
+    """Advance a (T, 3, 4) tiled fleet in place; the 4-lane inner loop vectorizes.
+
+    Scalars arrive pre-scaled by dt and in the fleet dtype, so a float32 fleet
+    is stepped entirely in float32.
+    """
+    for t in range(vel.shape[0]):
+        for j in range(4):
+            vx = vel[t, 0, j]
+            vy = vel[t, 1, j]
+            vz = vel[t, 2, j]
+            k_dt = kd_dt * math.sqrt(vx*vx + vy*vy + vz*vz)
+            vx += f_dt * prop[t, j] - k_dt * vx
+            vy -= k_dt * vy
+            vz -= k_dt * vz
+            vel[t, 0, j] = vx
+            vel[t, 1, j] = vy
+            vel[t, 2, j] = vz
+            pos[t, 0, j] += vx * dt
+            pos[t, 1, j] += vy * dt
+            pos[t, 2, j] += vz * dt
+            yaw[t, j] += yaw_fin[t, j] * fin_gain
+            pitch[t, j] += pitch_fin[t, j] * fin_gain
+
+def step_sim_aosoa(params, fleet, prop, yaw_fin, pitch_fin, dt):
+    """step_sim_batch for a FleetAoSoA; controls are (T, 4) arrays from fleet.tile() or scalars."""
+    shape, dtype = fleet.yaw.shape, fleet.yaw.dtype
+    f = dtype.type
+    a_dt = params.inv_mass * dt
+    _step_tiles(fleet.pos, fleet.vel, fleet.yaw, fleet.pitch,
+                f(params.thrust_max / 100.0 * a_dt), f(params.k_drag * a_dt), f(_FIN_RATE * dt),
+                np.broadcast_to(np.asarray(prop, dtype), shape),
+                np.broadcast_to(np.asarray(yaw_fin, dtype), shape),
+                np.broadcast_to(np.asarray(pitch_fin, dtype), shape), f(dt))
+
+def warmup_physics():
+    """Run one throwaway step so the JIT compile happens before serving."""
+    scratch = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3),
+                       yaw=0.0, pitch=0.0, roll=0.0)
+    step_sim(VehicleParams(), scratch, Controls(), 0.02)
 
 # -----------------------------
 # Web API
 # -----------------------------
 
 params = VehicleParams()
-state = SimState(pos=[0,0,0], vel=[0,0,0], omega=[0,0,0], yaw=0, pitch=0, roll=0)
+state = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0.0, pitch=0.0, roll=0.0)
 ctrl = Controls()
 
-async def status(request):
-    return web.json_response({
-        "pos_m": {"x":state.pos[0], "y":state.pos[1], "z":state.pos[2]},
-        "vel_mps": {"x":state.vel[0], "y":state.vel[1], "z":state.vel[2]},
-        "att_deg": {"yaw":rad2deg(state.yaw), "pitch":rad2deg(state.pitch), "roll":rad2deg(state.roll)},
-        "controls": {"pitch_fin":ctrl.pitch_fin, "yaw_fin":ctrl.yaw_fin, "prop":ctrl.prop}
+# Pre-serialized /status body, rebuilt whenever state or controls change
+status_body = b""
+
+# Fixed-shape status JSON; %a formats floats with their shortest round-trip repr.
+# %a would print nan/inf, which are not JSON, so publish_status only uses it for finite values.
+_STATUS_TEMPLATE = (
+    b'{"pos_m":{"x":%a,"y":%a,"z":%a},'
+    b'"vel_mps":{"x":%a,"y":%a,"z":%a},'
+    b'"att_deg":{"yaw":%a,"pitch":%a,"roll":%a},'
+    b'"controls":{"pitch_fin":%d,"yaw_fin":%d,"prop":%d}}'
+)
+
+def _status_body_slow(values, controls):
+    """Encode the status with json_dumps, writing non-finite floats as null"""
+    px, py, pz, vx, vy, vz, yaw, pitch, roll = [
+        v if math.isfinite(v) else None for v in values
+    ]
+    pitch_fin, yaw_fin, prop = controls
+    return json_dumps({
+        "pos_m": {"x": px, "y": py, "z": pz},
+        "vel_mps": {"x": vx, "y": vy, "z": vz},
+        "att_deg": {"yaw": yaw, "pitch": pitch, "roll": roll},
+        "controls": {"pitch_fin": pitch_fin, "yaw_fin": yaw_fin, "prop": prop},
     })
 
-async def set_pitch(request):
-    try:
-        data = await request.json()
-        
-        # Validate input
-        is_valid, error_msg = validator.validate_json_input(data)
-        if not is_valid:
-            security_logger.warning(f"Invalid pitch input from {request.remote}: {error_msg}")
-            return web.json_response({"error": error_msg}, status=400)
-        
-        # Validate value field exists and is numeric
-        if "value" not in data:
-            return web.json_response({"error": "Missing 'value' field"}, status=400)
-        
-        is_valid, error_msg = validator.validate_numeric_input(data["value"], -50, 50)
-        if not is_valid:
-            security_logger.warning(f"Invalid pitch value from {request.remote}: {error_msg}")
-            return web.json_response({"error": error_msg}, status=400)
-        
-        ctrl.pitch_fin = clamp(int(data["value"]), -30, 30)
-        security_logger.info(f"Pitch set to {ctrl.pitch_fin} from {request.remote}")
-        return web.json_response({"pitch_fin": ctrl.pitch_fin})
-    except Exception as e:
-        security_logger.error(f"Error setting pitch: {str(e)}")
-        return web.json_response({"error": "Invalid request"}, status=400)
+def publish_status():
+    global status_body
+    s = state
+    k = _RAD2DEG
+    px, py, pz = s.pos.tolist()
+    vx, vy, vz = s.vel.tolist()
+    values = (px, py, pz, vx, vy, vz,
+              float(s.yaw * k), float(s.pitch * k), float(s.roll * k))
+    # nan/inf propagate through the sum; a finite overflow only costs the slow path
+    if math.isfinite(sum(values)):
+        status_body = _STATUS_TEMPLATE % (*values, *ctrl.unpack())
+    else:
+        status_body = _status_body_slow(values, ctrl.unpack())
+
+publish_status()
 
-async def set_yaw(request):
-    try:
-        data = await request.json()
-        
-        # Validate input
-        is_valid, error_msg = validator.validate_json_input(data)
-        if not is_valid:
-            security_logger.warning(f"Invalid yaw input from {request.remote}: {error_msg}")
-            return web.json_response({"error": error_msg}, status=400)
-        
-        # Validate value field exists and is numeric
-        if "value" not in data:
-            return web.json_response({"error": "Missing 'value' field"}, status=400)
-        
-        is_valid, error_msg = validator.validate_numeric_input(data["value"], -50, 50)
-        if not is_valid:
-            security_logger.warning(f"Invalid yaw value from {request.remote}: {error_msg}")
-            return web.json_response({"error": error_msg}, status=400)
-        
-        ctrl.yaw_fin = clamp(int(data["value"]), -30, 30)
-        security_logger.info(f"Yaw set to {ctrl.yaw_fin} from {request.remote}")
-        return web.json_response({"yaw_fin": ctrl.yaw_fin})
-    except Exception as e:
-        security_logger.error(f"Error setting yaw: {str(e)}")
-        return web.json_response({"error": "Invalid request"}, status=400)
+async def status(request):
+    return web.Response(body=status_body, content_type="application/json")
 
-async def set_prop(request):
-    try:
-        data = await request.json()
-        
-        # Validate input
-        is_valid, error_msg = validator.validate_json_input(data)
-        if not is_valid:
-            security_logger.warning(f"Invalid prop input from {request.remote}: {error_msg}")
-            return web.json_response({"error": error_msg}, status=400)
-        
-        # Validate value field exists and is numeric
-        if "value" not in data:
-            return web.json_response({"error": "Missing 'value' field"}, status=400)
-        
-        is_valid, error_msg = validator.validate_numeric_input(data["value"], -50, 150)
-        if not is_valid:
-            security_logger.warning(f"Invalid prop value from {request.remote}: {error_msg}")
-            return web.json_response({"error": error_msg}, status=400)
-        
-        ctrl.prop = clamp(int(data["value"]), -30, 100)
-        security_logger.info(f"Prop set to {ctrl.prop} from {request.remote}")
-        return web.json_response({"prop": ctrl.prop})
-    except Exception as e:
-        security_logger.error(f"Error setting prop: {str(e)}")
-        return web.json_response({"error": "Invalid request"}, status=400)
+# Canonical setter body, e.g. {"value": 12}; anything else goes through the JSON parser.
+# At most 18 digits, so every match is also an int (not a float) to json_loads.
+_VALUE_BODY = re.compile(rb'[ \t\r\n]*\{[ \t\r\n]*"value"[ \t\r\n]*:[ \t\r\n]*(-?(?:0|[1-9][0-9]{0,17}))[ \t\r\n]*\}[ \t\r\n]*')
+# Parsed values must stay inside the fast path's range, whichever JSON backend is in use
+_VALUE_LIMIT = 10**18
+
+def _make_setter(attr, name):
+    """Build a POST handler that stores {"value": N} on ctrl.<attr> (Controls saturates it)"""
+    async def setter(request):
+        try:
+            body = await request.read()
+            
+            # Validate input
+            is_valid, error_msg = validator.validate_json_input(body)
+            if not is_valid:
+                security_logger.warning(f"Invalid {name} input from {request.remote}: {error_msg}")
+                return error_response(error_msg, 400)
+            
+            m = _VALUE_BODY.fullmatch(body)
+            if m is not None:
+                value = int(m[1])
+            else:
+                data = json_loads(body)
+                if not isinstance(data, dict):
+                    return error_response("Invalid JSON structure", 400)
+                
+                # Validate value field exists and is an integer
+                if "value" not in data:
+                    return error_response("Missing 'value' field", 400)
+                
+                value = data["value"]
+                if type(value) is not int or not -_VALUE_LIMIT < value < _VALUE_LIMIT:
+                    security_logger.warning(f"Invalid {name} value from {request.remote}: {value!r}")
+                    return error_response("Invalid numeric value", 400)
+            
+            setattr(ctrl, attr, value)
+            publish_status()
+            return json_response({attr: getattr(ctrl, attr)})
+        except web.HTTPRequestEntityTooLarge:
+            # Chunked bodies over client_max_size; match the Content-Length check
+            security_logger.warning(f"Oversized {name} body from {request.remote}")
+            return error_response("Payload too large", 413)
+        except Exception as e:
+            security_logger.error(f"Error setting {name}: {str(e)}")
+            return error_response("Invalid request", 400)
+    setter.__name__ = f"set_{name}"
+    return setter
+
+set_pitch = _make_setter("pitch_fin", "pitch")
+set_yaw = _make_setter("yaw_fin", "yaw")
+set_prop = _make_setter("prop", "prop")
 
 # -----------------------------
 # Simulation Loop
@@ -446,26 +773,54 @@ async def set_prop(request):
 
 async def sim_loop():
     dt = 0.02
+    max_lag = 0.5  # beyond this, drop the backlog instead of catching up
+    loop = asyncio.get_running_loop()
+    # Bind everything the tick touches once; the loop runs for the process lifetime
+    now = loop.time
+    sleep = asyncio.sleep
+    step, publish = step_sim, publish_status
+    p, s, c = params, state, ctrl
+    next_t = now()
     while True:
-        step_sim(params, state, ctrl, dt)
-        await asyncio.sleep(dt)
+        step(p, s, c, dt)
+        publish()
+
+        # Sleep until the next fixed deadline so step compute time does not
+        # stretch the period; when late, run the missed steps back to back.
+        next_t += dt
+        delay = next_t - now()
+        if delay < -max_lag:
+            next_t = now()
+        await sleep(delay if delay > 0.0 else 0.0)
 
 # -----------------------------
 # App Setup
 # -----------------------------
 
-app = web.Application(middlewares=[waf_middleware])
+# client_max_size also caps bodies sent without a Content-Length header
+app = web.Application(middlewares=[waf_middleware],
+                      client_max_size=RequestFilter.MAX_CONTENT_LENGTH)
 app.router.add_get("/status", status)
 app.router.add_post("/pitch", set_pitch)
 app.router.add_post("/yaw", set_yaw)
 app.router.add_post("/prop", set_prop)
 
 async def start():
+    warmup_physics()
     asyncio.create_task(sim_loop())
+    asyncio.create_task(rate_limiter.run_sweeper())
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", 8080)
     await site.start()
     security_logger.info("AUV Sim API running on :8080 with WAF protection enabled")
-
-asyncio.run(start())
+    try:
+        await asyncio.Event().wait()  # serve until cancelled
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    if uvloop is not None:
+        uvloop.run(start())
+    else:
+        asyncio.run(start())
@@ -1,133 +1,48 @@
 import pytest
+import pytest_asyncio
 import asyncio
+import copy
+import re
 import json
-from aiohttp import web
-from aiohttp.test_utils import AioHTTPTestCase, unittest_run_loop
+import pickle
+from aiohttp.test_utils import TestClient, TestServer
 
 # Import the components from auv_sim_api
+import auv_sim_api
+from auv_sim_api import (
+    RateLimiter, VehicleParams, SimState, Controls,
+    clamp, deg2rad, rad2deg, drag_force,
+    step_sim, run_sim, FleetState, step_sim_batch, FleetAoSoA, step_sim_aosoa,
+)
 import math
-from dataclasses import dataclass
+import numpy as np
 
 
-# Re-define classes for testing (copy from auv_sim_api.py)
-@dataclass
-class VehicleParams:
-    mass: float = 500.0
-    Ixx: float = 90.0
-    Iyy: float = 260.0
-    Izz: float = 260.0
-    rho: float = 1025.0
-    Cd: float = 0.1
-    area_ref: float = math.pi * (0.4572/2)**2
-    thrust_max: float = 9000.0
-    fin_area: float = 0.0207
-    fin_lift_slope: float = 3.5
-    fin_x: float = -1.8
-
-
-@dataclass
-class SimState:
-    pos: list
-    vel: list
-    omega: list
-    yaw: float
-    pitch: float
-    roll: float
-
-
-@dataclass
-class Controls:
-    pitch_fin: int = 0
-    yaw_fin: int = 0
-    prop: int = 0
-
-
-# Utility functions
-def clamp(x, lo, hi):
-    return max(lo, min(hi, x))
-
-
-def deg2rad(d):
-    return d * math.pi / 180
-
-
-def rad2deg(r):
-    return r * 180 / math.pi
-
-
-def drag_force(params, vel):
-    v = math.sqrt(sum(v*v for v in vel))
-    if v < 1e-6:
-        return [0, 0, 0]
-    k = 0.5 * params.rho * params.Cd * params.area_ref
-    return [-k*v*vel[0], -k*v*vel[1], -k*v*vel[2]]
-
-
-def step_sim(params, state, ctrl, dt):
-    Fx = params.thrust_max * (ctrl.prop / 100.0)
-    Fd = drag_force(params, state.vel)
-
-    ax = (Fx + Fd[0]) / params.mass
-    ay = Fd[1] / params.mass
-    az = Fd[2] / params.mass
+# Test fixtures
+@pytest_asyncio.fixture(scope="module", loop_scope="module")
+async def client():
+    """One client for the service app, WAF middleware included, shared by the API tests"""
+    async with TestClient(TestServer(auv_sim_api.app)) as client:
+        yield client
 
-    state.vel[0] += ax * dt
-    state.vel[1] += ay * dt
-    state.vel[2] += az * dt
 
-    state.pos[0] += state.vel[0] * dt
-    state.pos[1] += state.vel[1] * dt
-    state.pos[2] += state.vel[2] * dt
+@pytest.fixture
+def reset_service():
+    """Start from the initial state, resetting the service's containers in place"""
+    auv_sim_api.state.__init__(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3),
+                               yaw=0.0, pitch=0.0, roll=0.0)
+    auv_sim_api.ctrl.__init__()
+    auv_sim_api.publish_status()
+    auv_sim_api.rate_limiter.clients.clear()
 
-    # Simple yaw/pitch from fins
-    state.yaw += deg2rad(ctrl.yaw_fin) * dt * 0.1
-    state.pitch += deg2rad(ctrl.pitch_fin) * dt * 0.1
 
+@pytest.mark.asyncio(loop_scope="module")
+@pytest.mark.usefixtures("reset_service")
+class TestAUVSimAPI:
 
-# Test fixtures
-class TestAUVSimAPI(AioHTTPTestCase):
-    
-    async def get_application(self):
-        """Create and setup the test app"""
-        self.params = VehicleParams()
-        self.state = SimState(pos=[0, 0, 0], vel=[0, 0, 0], omega=[0, 0, 0], yaw=0, pitch=0, roll=0)
-        self.ctrl = Controls()
-        
-        # Create handlers
-        async def status(request):
-            return web.json_response({
-                "pos_m": {"x": self.state.pos[0], "y": self.state.pos[1], "z": self.state.pos[2]},
-                "vel_mps": {"x": self.state.vel[0], "y": self.state.vel[1], "z": self.state.vel[2]},
-                "att_deg": {"yaw": rad2deg(self.state.yaw), "pitch": rad2deg(self.state.pitch), "roll": rad2deg(self.state.roll)},
-                "controls": {"pitch_fin": self.ctrl.pitch_fin, "yaw_fin": self.ctrl.yaw_fin, "prop": self.ctrl.prop}
-            })
-
-        async def set_pitch(request):
-            data = await request.json()
-            self.ctrl.pitch_fin = clamp(int(data["value"]), -30, 30)
-            return web.json_response({"pitch_fin": self.ctrl.pitch_fin})
-
-        async def set_yaw(request):
-            data = await request.json()
-            self.ctrl.yaw_fin = clamp(int(data["value"]), -30, 30)
-            return web.json_response({"yaw_fin": self.ctrl.yaw_fin})
-
-        async def set_prop(request):
-            data = await request.json()
-            self.ctrl.prop = clamp(int(data["value"]), -30, 100)
-            return web.json_response({"prop": self.ctrl.prop})
-        
-        app = web.Application()
-        app.router.add_get("/status", status)
-        app.router.add_post("/pitch", set_pitch)
-        app.router.add_post("/yaw", set_yaw)
-        app.router.add_post("/prop", set_prop)
-        return app
-
-    @unittest_run_loop
-    async def test_status_initial_state(self):
+    async def test_status_initial_state(self, client):
         """Test that status endpoint returns initial state"""
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         assert resp.status == 200
         data = await resp.json()
         
@@ -145,126 +60,114 @@ class TestAUVSimAPI(AioHTTPTestCase):
         assert data["controls"]["yaw_fin"] == 0
         assert data["controls"]["prop"] == 0
 
-    @unittest_run_loop
-    async def test_set_pitch_valid(self):
+    async def test_set_pitch_valid(self, client):
         """Test setting pitch fin with valid values"""
-        resp = await self.client.request("POST", "/pitch", json={"value": 15})
+        resp = await client.request("POST", "/pitch", json={"value": 15})
         assert resp.status == 200
         data = await resp.json()
         assert data["pitch_fin"] == 15
         
         # Verify status reflects change
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         status_data = await resp.json()
         assert status_data["controls"]["pitch_fin"] == 15
 
-    @unittest_run_loop
-    async def test_set_pitch_clamp_positive(self):
+    async def test_set_pitch_clamp_positive(self, client):
         """Test pitch fin clamping on positive side"""
-        resp = await self.client.request("POST", "/pitch", json={"value": 50})
+        resp = await client.request("POST", "/pitch", json={"value": 50})
         assert resp.status == 200
         data = await resp.json()
         assert data["pitch_fin"] == 30  # Should be clamped to max 30
 
-    @unittest_run_loop
-    async def test_set_pitch_clamp_negative(self):
+    async def test_set_pitch_clamp_negative(self, client):
         """Test pitch fin clamping on negative side"""
-        resp = await self.client.request("POST", "/pitch", json={"value": -50})
+        resp = await client.request("POST", "/pitch", json={"value": -50})
         assert resp.status == 200
         data = await resp.json()
         assert data["pitch_fin"] == -30  # Should be clamped to min -30
 
-    @unittest_run_loop
-    async def test_set_yaw_valid(self):
+    async def test_set_yaw_valid(self, client):
         """Test setting yaw fin with valid values"""
-        resp = await self.client.request("POST", "/yaw", json={"value": 20})
+        resp = await client.request("POST", "/yaw", json={"value": 20})
         assert resp.status == 200
         data = await resp.json()
         assert data["yaw_fin"] == 20
         
         # Verify status reflects change
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         status_data = await resp.json()
         assert status_data["controls"]["yaw_fin"] == 20
 
-    @unittest_run_loop
-    async def test_set_yaw_clamp_positive(self):
+    async def test_set_yaw_clamp_positive(self, client):
         """Test yaw fin clamping on positive side"""
-        resp = await self.client.request("POST", "/yaw", json={"value": 100})
+        resp = await client.request("POST", "/yaw", json={"value": 100})
         assert resp.status == 200
         data = await resp.json()
         assert data["yaw_fin"] == 30  # Should be clamped to max 30
 
-    @unittest_run_loop
-    async def test_set_yaw_clamp_negative(self):
+    async def test_set_yaw_clamp_negative(self, client):
         """Test yaw fin clamping on negative side"""
-        resp = await self.client.request("POST", "/yaw", json={"value": -100})
+        resp = await client.request("POST", "/yaw", json={"value": -100})
         assert resp.status == 200
         data = await resp.json()
         assert data["yaw_fin"] == -30  # Should be clamped to min -30
 
-    @unittest_run_loop
-    async def test_set_prop_valid(self):
+    async def test_set_prop_valid(self, client):
         """Test setting propeller with valid values"""
-        resp = await self.client.request("POST", "/prop", json={"value": 50})
+        resp = await client.request("POST", "/prop", json={"value": 50})
         assert resp.status == 200
         data = await resp.json()
         assert data["prop"] == 50
         
         # Verify status reflects change
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         status_data = await resp.json()
         assert status_data["controls"]["prop"] == 50
 
-    @unittest_run_loop
-    async def test_set_prop_clamp_positive(self):
+    async def test_set_prop_clamp_positive(self, client):
         """Test propeller clamping on positive side"""
-        resp = await self.client.request("POST", "/prop", json={"value": 150})
+        resp = await client.request("POST", "/prop", json={"value": 150})
         assert resp.status == 200
         data = await resp.json()
         assert data["prop"] == 100  # Should be clamped to max 100
 
-    @unittest_run_loop
-    async def test_set_prop_clamp_negative(self):
+    async def test_set_prop_clamp_negative(self, client):
         """Test propeller clamping on negative side"""
-        resp = await self.client.request("POST", "/prop", json={"value": -50})
+        resp = await client.request("POST", "/prop", json={"value": -50})
         assert resp.status == 200
         data = await resp.json()
         assert data["prop"] == -30  # Should be clamped to min -30
 
-    @unittest_run_loop
-    async def test_set_prop_zero(self):
+    async def test_set_prop_zero(self, client):
         """Test setting propeller to zero (neutral)"""
-        resp = await self.client.request("POST", "/prop", json={"value": 0})
+        resp = await client.request("POST", "/prop", json={"value": 0})
         assert resp.status == 200
         data = await resp.json()
         assert data["prop"] == 0
 
-    @unittest_run_loop
-    async def test_multiple_controls_sequence(self):
+    async def test_multiple_controls_sequence(self, client):
         """Test setting multiple controls in sequence"""
         # Set pitch
-        resp = await self.client.request("POST", "/pitch", json={"value": 10})
+        resp = await client.request("POST", "/pitch", json={"value": 10})
         assert resp.status == 200
         
         # Set yaw
-        resp = await self.client.request("POST", "/yaw", json={"value": -15})
+        resp = await client.request("POST", "/yaw", json={"value": -15})
         assert resp.status == 200
         
         # Set prop
-        resp = await self.client.request("POST", "/prop", json={"value": 75})
+        resp = await client.request("POST", "/prop", json={"value": 75})
         assert resp.status == 200
         
         # Check status shows all changes
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         assert resp.status == 200
         data = await resp.json()
         assert data["controls"]["pitch_fin"] == 10
         assert data["controls"]["yaw_fin"] == -15
         assert data["controls"]["prop"] == 75
 
-    @unittest_run_loop
-    async def test_boundary_values(self):
+    async def test_boundary_values(self, client):
         """Test boundary values for all controls"""
         test_cases = [
             ("/pitch", -30, -30),
@@ -276,7 +179,7 @@ class TestAUVSimAPI(AioHTTPTestCase):
         ]
         
         for endpoint, input_val, expected in test_cases:
-            resp = await self.client.request("POST", endpoint, json={"value": input_val})
+            resp = await client.request("POST", endpoint, json={"value": input_val})
             assert resp.status == 200
             data = await resp.json()
             control_name = endpoint.strip("/") + "_fin" if "fin" in endpoint else endpoint.strip("/")
@@ -287,19 +190,17 @@ class TestAUVSimAPI(AioHTTPTestCase):
             elif control_name == "prop":
                 assert data["prop"] == expected, f"Failed for {endpoint} with value {input_val}"
 
-    @unittest_run_loop
-    async def test_response_content_type(self):
+    async def test_response_content_type(self, client):
         """Test that responses have correct content type"""
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         assert resp.content_type == "application/json"
         
-        resp = await self.client.request("POST", "/pitch", json={"value": 10})
+        resp = await client.request("POST", "/pitch", json={"value": 10})
         assert resp.content_type == "application/json"
 
-    @unittest_run_loop
-    async def test_status_response_structure(self):
+    async def test_status_response_structure(self, client):
         """Test that status response has all required fields"""
-        resp = await self.client.request("GET", "/status")
+        resp = await client.request("GET", "/status")
         data = await resp.json()
         
         # Check top-level keys
@@ -349,13 +250,13 @@ class TestPhysicsUtils:
     def test_drag_force_zero_velocity(self):
         """Test drag force is zero at zero velocity"""
         params = VehicleParams()
-        force = drag_force(params, [0, 0, 0])
-        assert force == [0, 0, 0]
+        force = drag_force(params, np.zeros(3))
+        assert force == (0.0, 0.0, 0.0)
 
     def test_drag_force_opposes_motion(self):
         """Test drag force opposes velocity direction"""
         params = VehicleParams()
-        force = drag_force(params, [1, 0, 0])
+        force = drag_force(params, np.array([1.0, 0.0, 0.0]))
         assert force[0] < 0  # Force opposes positive x velocity
         assert force[1] == 0
         assert force[2] == 0
@@ -363,7 +264,7 @@ class TestPhysicsUtils:
     def test_step_sim_basic(self):
         """Test basic simulation step"""
         params = VehicleParams()
-        state = SimState(pos=[0, 0, 0], vel=[0, 0, 0], omega=[0, 0, 0], yaw=0, pitch=0, roll=0)
+        state = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0, pitch=0, roll=0)
         ctrl = Controls(prop=100)
         dt = 0.01
         
@@ -376,7 +277,7 @@ class TestPhysicsUtils:
     def test_step_sim_multiple_steps(self):
         """Test multiple simulation steps accumulate changes"""
         params = VehicleParams()
-        state = SimState(pos=[0, 0, 0], vel=[0, 0, 0], omega=[0, 0, 0], yaw=0, pitch=0, roll=0)
+        state = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0, pitch=0, roll=0)
         ctrl = Controls(prop=50)
         dt = 0.01
         
@@ -391,7 +292,7 @@ class TestPhysicsUtils:
     def test_step_sim_fin_control(self):
         """Test fin control affects attitude"""
         params = VehicleParams()
-        state = SimState(pos=[0, 0, 0], vel=[0, 0, 0], omega=[0, 0, 0], yaw=0, pitch=0, roll=0)
+        state = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0, pitch=0, roll=0)
         ctrl = Controls(pitch_fin=10)
         dt = 0.01
         
@@ -401,6 +302,433 @@ class TestPhysicsUtils:
         # Positive pitch fin should increase pitch
         assert state.pitch > initial_pitch
 
+    def test_run_sim_matches_step_loop(self):
+        """Test compiled multi-step run matches repeated step_sim calls"""
+        params = VehicleParams()
+        ctrl = Controls(prop=75, yaw_fin=-5, pitch_fin=12)
+        looped = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0.0, pitch=0.0, roll=0.0)
+        batched = SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0.0, pitch=0.0, roll=0.0)
+        dt = 0.01
+
+        for _ in range(200):
+            step_sim(params, looped, ctrl, dt)
+        run_sim(params, batched, ctrl, dt, 200)
+
+        assert np.allclose(batched.pos, looped.pos)
+        assert np.allclose(batched.vel, looped.vel)
+        assert np.isclose(batched.yaw, looped.yaw)
+        assert np.isclose(batched.pitch, looped.pitch)
+
+    def test_step_sim_batch_matches_single(self):
+        """Test batched step gives the same result as per-vehicle steps"""
+        params = VehicleParams()
+        controls = [Controls(prop=100), Controls(prop=-30, yaw_fin=20), Controls(pitch_fin=-10, prop=50)]
+        fleet = FleetState.zeros(len(controls))
+        states = [SimState(pos=np.zeros(3), vel=np.zeros(3), omega=np.zeros(3), yaw=0.0, pitch=0.0, roll=0.0)
+                  for _ in controls]
+        prop = np.array([c.prop for c in controls], dtype=float)
+        yaw_fin = np.array([c.yaw_fin for c in controls], dtype=float)
+        pitch_fin = np.array([c.pitch_fin for c in controls], dtype=float)
+        dt = 0.01
+
+        for _ in range(50):
+            step_sim_batch(params, fleet, prop, yaw_fin, pitch_fin, dt)
+            for state, ctrl in zip(states, controls):
+                step_sim(params, state, ctrl, dt)
+
+        assert fleet.pos.dtype == fleet.vel.dtype == fleet.yaw.dtype == np.float32
+        for i, state in enumerate(states):
+            assert np.allclose(fleet.pos[i], state.pos)
+            assert np.allclose(fleet.vel[i], state.vel)
+            assert np.isclose(fleet.yaw[i], state.yaw)
+            assert np.isclose(fleet.pitch[i], state.pitch)
+
+    def test_step_sim_aosoa_matches_batch(self):
+        """Test tiled fleet step matches the struct-of-arrays batch step"""
+        params = VehicleParams()
+        n = 6  # leaves two padding lanes in the second tile
+        prop = np.array([100, 80, -30, 0, 55, 10], dtype=float)
+        yaw_fin = np.array([0, 5, -5, 30, -30, 1], dtype=float)
+        pitch_fin = np.array([3, 0, 0, -12, 8, 30], dtype=float)
+        fleet = FleetState.zeros(n)
+        tiles = FleetAoSoA.zeros(n)
+        t_prop, t_yaw, t_pitch = tiles.tile(prop), tiles.tile(yaw_fin), tiles.tile(pitch_fin)
+        dt = 0.01
+
+        for _ in range(50):
+            step_sim_batch(params, fleet, prop, yaw_fin, pitch_fin, dt)
+            step_sim_aosoa(params, tiles, t_prop, t_yaw, t_pitch, dt)
+
+        out = tiles.to_fleet()
+        assert out.pos.dtype == out.vel.dtype == out.yaw.dtype == np.float32
+        assert np.allclose(out.pos, fleet.pos)
+        assert np.allclose(out.vel, fleet.vel)
+        assert np.allclose(out.yaw, fleet.yaw)
+        assert np.allclose(out.pitch, fleet.pitch)
+
+    def test_controls_packed_fields(self):
+        """Test packed controls keep fields independent, saturate to limits and coerce to int"""
+        ctrl = Controls(pitch_fin=-12, yaw_fin=7, prop=100)
+        assert ctrl.unpack() == (-12, 7, 100)
+
+        ctrl.yaw_fin = -30
+        assert (ctrl.pitch_fin, ctrl.yaw_fin, ctrl.prop) == (-12, -30, 100)
+
+        ctrl = Controls(pitch_fin=500, yaw_fin=-500, prop=-500)
+        assert ctrl.unpack() == (30, -30, -30)
+        ctrl = Controls(pitch_fin=-500, yaw_fin=500, prop=500)
+        assert ctrl.unpack() == (-30, 30, 100)
+        ctrl.prop = 10**9
+        assert ctrl.prop == 100
+
+        # Float and NumPy scalars are coerced, as the old dataclass allowed
+        ctrl = Controls(pitch_fin=12.0, yaw_fin=np.float64(-7.0), prop=50.0)
+        assert ctrl.unpack() == (12, -7, 50)
+        assert all(type(v) is int for v in ctrl.unpack())
+
+        ctrl = Controls(pitch_fin=np.int64(99), yaw_fin=-1e9, prop=float("inf"))
+        assert ctrl.unpack() == (30, -30, 100)
+        ctrl.pitch_fin = np.float32(-31.5)
+        ctrl.yaw_fin = 29.9
+        assert (ctrl.pitch_fin, ctrl.yaw_fin) == (-30, 29)
+
+        with pytest.raises(ValueError):
+            ctrl.prop = float("nan")
+        assert ctrl.prop == 100
+
+    def test_slotted_state_copy_and_pickle(self):
+        """Test slotted state containers still survive copy and pickle"""
+        params = VehicleParams(mass=250.0)
+        state = SimState(pos=np.array([1.0, 2.0, 3.0]), vel=np.zeros(3), omega=np.zeros(3),
+                         yaw=0.5, pitch=-0.1, roll=0.0)
+        ctrl = Controls(pitch_fin=10, yaw_fin=-5, prop=80)
+
+        for obj in (params, state, ctrl):
+            assert not hasattr(obj, "__dict__")
+
+        restored = pickle.loads(pickle.dumps(params))
+        assert restored == params
+        assert restored.inv_mass == params.inv_mass
+        assert restored.k_drag == params.k_drag
+
+        clone = copy.deepcopy(state)
+        clone.pos[0] = 99.0
+        assert state.pos[0] == 1.0
+        assert clone.yaw == state.yaw
+
+        assert pickle.loads(pickle.dumps(ctrl)) == ctrl
+
+
+
+@pytest.mark.asyncio(loop_scope="module")
+@pytest.mark.usefixtures("reset_service")
+class TestServiceAPI:
+
+    async def test_chunked_body_over_client_max_size(self, client):
+        """Test a chunked body past client_max_size gets the same 413 as the Content-Length check"""
+        async def chunks():
+            for _ in range(4):
+                yield b" " * 4096
+
+        resp = await client.post("/pitch", data=chunks())
+        assert resp.status == 413
+        assert await resp.json() == {"error": "Payload too large"}
+
+        size = auv_sim_api.RequestFilter.MAX_CONTENT_LENGTH + 1
+        resp = await client.post("/pitch", data=b" " * size)
+        assert resp.status == 413
+        assert await resp.json() == {"error": "Payload too large"}
+
+
+    @pytest.mark.parametrize("body, status, expected", [
+        (b'{"value": 12}', 200, {"pitch_fin": 12}),
+        (b'{"value":-7}', 200, {"pitch_fin": -7}),
+        (b' { "value" : 5 } ', 200, {"pitch_fin": 5}),
+        (b'\n\t{"value":\r\n30}\n', 200, {"pitch_fin": 30}),
+        (b'{"value": 999999999999999999}', 200, {"pitch_fin": 30}),
+        (b'{"value": 99999999999999999999}', 400, None),
+        (b'{"value":  99999999999999999999}', 400, None),
+        (b'{"value": 012}', 400, None),
+        (b'{"value": 1.5}', 400, {"error": "Invalid numeric value"}),
+        (b'{"value": "12"}', 400, {"error": "Invalid numeric value"}),
+        (b'{"v": 12}', 400, {"error": "Missing 'value' field"}),
+        (b'{"value": 12, "extra": 1}', 200, {"pitch_fin": 12}),
+    ])
+    async def test_setter_parse_paths_agree(self, client, monkeypatch, body, status, expected):
+        """Test the regex fast path and both json_loads fallbacks answer every body alike"""
+        results = []
+        for mode in ("fast path", "json_loads fallback", "stdlib json fallback"):
+            if mode != "fast path":
+                monkeypatch.setattr(auv_sim_api, "_VALUE_BODY", re.compile(rb"(?!)"))
+            if mode == "stdlib json fallback":
+                monkeypatch.setattr(auv_sim_api, "json_loads", json.loads)
+            auv_sim_api.ctrl.__init__()
+            resp = await client.post("/pitch", data=body,
+                                         headers={"Content-Type": "application/json"})
+            results.append((resp.status, await resp.json()))
+
+        assert results[0] == results[1] == results[2]
+        assert results[0][0] == status
+        if expected is not None:
+            assert results[0][1] == expected
+
+
+    async def test_status_stays_valid_json_with_non_finite_state(self, client):
+        """Test a NaN/inf in the state is published as null instead of breaking /status"""
+        state = auv_sim_api.state
+        saved = state.pos.copy(), state.vel.copy(), state.yaw
+        try:
+            state.pos[1] = float("nan")
+            state.vel[0] = float("inf")
+            state.yaw = float("-inf")
+            auv_sim_api.publish_status()
+            data = strict_json(auv_sim_api.status_body)
+            assert data["pos_m"] == {"x": saved[0][0], "y": None, "z": saved[0][2]}
+            assert data["vel_mps"]["x"] is None
+            assert data["att_deg"]["yaw"] is None
+            assert data["controls"] == {"pitch_fin": 0, "yaw_fin": 0, "prop": 0}
+
+            resp = await client.get("/status")
+            assert strict_json(await resp.read()) == data
+        finally:
+            state.pos[:], state.vel[:], state.yaw = saved
+            auv_sim_api.publish_status()
+
+        data = strict_json(auv_sim_api.status_body)
+        assert data["att_deg"]["yaw"] == saved[2]
+
+
+def strict_json(body):
+    """Parse body as strict JSON, rejecting NaN/Infinity"""
+    def reject(const):
+        raise ValueError(f"non-JSON constant {const}")
+    return json.loads(body, parse_constant=reject)
+
+
+# Unit tests for the pre-rendered /status body
+@pytest.mark.usefixtures("reset_service")
+class TestStatusBody:
+
+    def set_state(self):
+        state, ctrl = auv_sim_api.state, auv_sim_api.ctrl
+        state.pos[:] = [1.25, -3e-7, 123456.789]
+        state.vel[:] = [0.1, 0.2, -0.30000000000000004]
+        state.yaw, state.pitch, state.roll = 0.3, -0.05, 0.0
+        ctrl.pitch_fin, ctrl.yaw_fin, ctrl.prop = -12, 7, 100
+
+    def test_publish_status_renders_exact_state(self):
+        """Test the template fill round-trips every field at full precision"""
+        self.set_state()
+        auv_sim_api.publish_status()
+        data = strict_json(auv_sim_api.status_body)
+
+        k = auv_sim_api._RAD2DEG
+        assert data == {
+            "pos_m": {"x": 1.25, "y": -3e-7, "z": 123456.789},
+            "vel_mps": {"x": 0.1, "y": 0.2, "z": -0.30000000000000004},
+            "att_deg": {"yaw": 0.3 * k, "pitch": -0.05 * k, "roll": 0.0},
+            "controls": {"pitch_fin": -12, "yaw_fin": 7, "prop": 100},
+        }
+
+    def test_slow_body_matches_template(self):
+        """Test the json_dumps fallback encodes finite state exactly like the template"""
+        self.set_state()
+        auv_sim_api.publish_status()
+        state, k = auv_sim_api.state, auv_sim_api._RAD2DEG
+        values = (*state.pos.tolist(), *state.vel.tolist(),
+                  state.yaw * k, state.pitch * k, state.roll * k)
+        slow = auv_sim_api._status_body_slow(values, auv_sim_api.ctrl.unpack())
+        assert strict_json(slow) == strict_json(auv_sim_api.status_body)
+
+    def test_slow_body_writes_non_finite_as_null(self):
+        """Test the fallback encodes nan/inf as null and keeps the other fields"""
+        values = (float("nan"), 1.0, 2.0, float("inf"), 0.0, 0.0, float("-inf"), 5.0, 0.0)
+        data = strict_json(auv_sim_api._status_body_slow(values, (1, 2, 3)))
+        assert data["pos_m"] == {"x": None, "y": 1.0, "z": 2.0}
+        assert data["vel_mps"] == {"x": None, "y": 0.0, "z": 0.0}
+        assert data["att_deg"] == {"yaw": None, "pitch": 5.0, "roll": 0.0}
+        assert data["controls"] == {"pitch_fin": 1, "yaw_fin": 2, "prop": 3}
+
+
+# WAF payload table: bodies that must pass, and attacks that must be blocked
+ALLOWED_BODIES = [
+    b'{"value": 12}',
+    b'{"value": -30}',
+    b'{"name": "alpha", "depth": -3.5}',
+    b'{"tags": ["a", "b"], "note": "dive now"}',
+    b'{"empty": "", "nested": {"k": "v"}}',
+]
+
+BLOCKED_BODIES = [
+    b'{"value": "1\' OR \'1\'=\'1"}',
+    b'{"value": "admin\'--"}',
+    b'{"value": "1; DROP TABLE users"}',
+    b'{"value": "1 UNION SELECT password FROM users"}',
+    b'{"value": "1/**/OR/**/1=1"}',
+    b'{"value": "exec xp_cmdshell"}',
+    # JSON escapes would hide characters from the raw-byte scan
+    b'{"value": "\\u0027 OR 1=1"}',
+    b'{"value": "\\u003cscript\\u003e"}',
+    b'{"path": "C:\\\\temp"}',
+]
+
+# One payload per alternative family, each hitting exactly one of the original
+# patterns, so _scan must report that pattern's key on either backend
+RULE_HITS = [
+    (b'{"q": "UNION"}', "sql"),
+    (b'{"q": "it\'s"}', "sql"),
+    (b'{"q": "a -- b"}', "sql"),
+    (b'{"q": "<iframe src=x>"}', "xss"),
+    (b'{"q": "<img onerror=x>"}', "xss"),
+    (b'{"q": "expression(x)"}', "xss"),
+    (b'{"q": "../etc/passwd"}', "path"),
+    (b'{"q": "%2E%2E/etc"}', "path"),
+    (b'{"q": "`id`"}', "cmd"),
+    (b'{"q": "$(id)"}', "cmd"),
+    (b'{"q": "a && b"}', "cmd"),
+    (b'{"q": "a | b"}', "cmd"),
+    (b'{"q": "\\u003c"}', "esc"),
+]
+
+
+# Unit tests for the real WAF input validator, run once per scan backend
+class TestInputValidator:
+
+    @pytest.fixture(autouse=True, params=["hyperscan", "re"])
+    def backend(self, request, monkeypatch):
+        """Scan with the Hyperscan database, or force the _COMBINED regex fallback"""
+        if request.param == "hyperscan":
+            if auv_sim_api.InputValidator._HS_DB is None:
+                pytest.skip("hyperscan is not installed")
+        else:
+            monkeypatch.setattr(auv_sim_api.InputValidator, "_HS_DB", None)
+        return request.param
+
+    @pytest.mark.parametrize("body", ALLOWED_BODIES)
+    def test_benign_json_passes(self, body):
+        """Test ordinary JSON, double quotes included, is not flagged"""
+        assert auv_sim_api.InputValidator.validate_json_input(body) == (True, None)
+
+    @pytest.mark.parametrize("body", BLOCKED_BODIES)
+    def test_sql_injection_blocked(self, body):
+        """Test SQL injection payloads are still rejected without '"' in the SQL set"""
+        assert auv_sim_api.InputValidator.validate_json_input(body) == (False, "Invalid characters detected")
+
+    @pytest.mark.parametrize("body,key", RULE_HITS)
+    def test_each_rule_still_matches(self, body, key):
+        """Test every original pattern is still reached through the combined scan"""
+        V = auv_sim_api.InputValidator
+        rules = {
+            "sql": V.SQL_INJECTION_PATTERN,
+            "xss": V.XSS_PATTERN,
+            "path": V.PATH_TRAVERSAL_PATTERN,
+            "cmd": V.COMMAND_INJECTION_PATTERN,
+            "esc": V.ESCAPE_PATTERN,
+        }
+        assert [k for k, rule in rules.items() if rule.search(body)] == [key]
+        assert V._scan(body) == key
+        assert V.validate_json_input(body) == (False, "Invalid characters detected")
+
+
+# Unit tests for the real WAF rate limiter; time is injected through `now`
+class TestRateLimiter:
+
+    def test_limit_trips_at_300_in_one_window(self):
+        """Test the 301st request inside one window trips the limit"""
+        limiter = RateLimiter()
+        for i in range(300):
+            assert limiter.check("10.0.0.1", now=i * 0.1) == (True, None)
+        assert limiter.check("10.0.0.1", now=30.0) == (False, "Rate limit exceeded")
+
+    def test_blocked_for_block_seconds(self):
+        """Test every request is refused for the 5-minute block, then allowed again"""
+        limiter = RateLimiter()
+        for _ in range(300):
+            limiter.check("10.0.0.1", now=10.0)
+        assert limiter.check("10.0.0.1", now=10.0) == (False, "Rate limit exceeded")
+
+        for t in range(10, 310):
+            assert limiter.check("10.0.0.1", now=float(t)) == (False, "IP is blocked")
+        assert limiter.check("10.0.0.1", now=310.0) == (True, None)
+
+    def test_previous_window_weight_decays(self):
+        """Test the previous window's count is weighted by its remaining overlap"""
+        limiter = RateLimiter()
+        for _ in range(300):
+            limiter.check("10.0.0.1", now=0.0)
+
+        # Right at the rollover the previous window still counts in full
+        probe = RateLimiter()
+        for _ in range(300):
+            probe.check("10.0.0.2", now=0.0)
+        assert probe.check("10.0.0.2", now=60.0) == (False, "Rate limit exceeded")
+
+        # Halfway into the next window it weighs 300 * 0.5 = 150
+        for _ in range(150):
+            assert limiter.check("10.0.0.1", now=90.0) == (True, None)
+        assert limiter.check("10.0.0.1", now=90.0) == (False, "Rate limit exceeded")
+
+    def test_previous_window_dropped_after_two_windows(self):
+        """Test a full window of traffic no longer counts two windows later"""
+        limiter = RateLimiter()
+        for _ in range(300):
+            limiter.check("10.0.0.1", now=0.0)
+        for _ in range(299):
+            assert limiter.check("10.0.0.1", now=120.0) == (True, None)
+
+    def test_eviction_drops_least_recently_seen(self):
+        """Test the table is capped by evicting the least recently seen IP"""
+        limiter = RateLimiter(max_tracked_ips=2)
+        limiter.check("10.0.0.1", now=0.0)
+        limiter.check("10.0.0.2", now=1.0)
+        limiter.check("10.0.0.1", now=2.0)  # refreshes .1, so .2 is now oldest
+        limiter.check("10.0.0.3", now=3.0)
+        assert list(limiter.clients) == ["10.0.0.1", "10.0.0.3"]
+
+    def test_eviction_cannot_lift_a_ban(self):
+        """Test cycling through many source IPs does not flush an active ban"""
+        limiter = RateLimiter(requests_per_minute=3, max_tracked_ips=4)
+        for _ in range(3):
+            assert limiter.check("10.0.0.66", now=0.0) == (True, None)
+        assert limiter.check("10.0.0.66", now=0.0) == (False, "Rate limit exceeded")
+
+        for i in range(50):
+            limiter.check(f"192.168.0.{i}", now=1.0)
+        assert len(limiter.clients) == 4
+        assert "10.0.0.66" in limiter.clients
+        assert limiter.check("10.0.0.66", now=2.0) == (False, "IP is blocked")
+
+    def test_eviction_overflows_only_by_banned_ips(self):
+        """Test the cap is exceeded only when every older IP is banned"""
+        limiter = RateLimiter(requests_per_minute=1, max_tracked_ips=2)
+        for ip in ("10.0.0.1", "10.0.0.2"):
+            limiter.check(ip, now=0.0)
+            limiter.check(ip, now=0.0)  # trips the limit of 1
+        assert limiter.check("10.0.0.3", now=1.0) == (True, None)
+        assert set(limiter.clients) == {"10.0.0.1", "10.0.0.2", "10.0.0.3"}
+
+        # The next new IP evicts the unbanned .3, not a ban
+        limiter.check("10.0.0.4", now=2.0)
+        assert set(limiter.clients) == {"10.0.0.1", "10.0.0.2", "10.0.0.4"}
+
+    def test_sweep_drops_stale_state_and_expired_bans(self):
+        """Test sweep keeps active IPs and bans, and drops quiet IPs and lapsed bans"""
+        limiter = RateLimiter(requests_per_minute=1, window_seconds=60, block_seconds=300)
+        limiter.check("quiet", now=0.0)
+        limiter.check("banned", now=0.0)
+        limiter.check("banned", now=0.0)  # trips the limit of 1
+        limiter.check("active", now=100.0)
+
+        limiter.sweep(now=125.0)
+        assert set(limiter.clients) == {"active", "banned"}
+        assert limiter.clients["banned"].blocked_until == 300.0
+
+        limiter.sweep(now=299.0)
+        assert "banned" in limiter.clients
+        limiter.sweep(now=300.0)
+        assert "banned" not in limiter.clients
+        assert limiter.check("banned", now=300.0) == (True, None)
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])